@@ -0,0 +1,115 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# -*- coding: utf-8 -*-
+
+"""
+Compiled equivalent of `ConvertJSON.parse', for large keys. Build it in place
+with
+
+    cythonize -i convertjson_fast.pyx
+
+and decode.py/time.py will pick it up; without it, they fall back to the
+pure-Python parser. Errors are raised as ValueError (with what it's stuck on),
+which the callers turn into InvalidArrayFormat.
+
+Like `ConvertJSON.parse', works over the UTF-8 bytes of the key, so string
+lengths are counted in bytes, as PHP writes them.
+"""
+
+cdef extern from "Python.h":
+    const char *PyUnicode_AsUTF8AndSize(object, Py_ssize_t *) except NULL
+
+
+cdef inline Py_ssize_t _index(const char *buf, Py_ssize_t length,
+                              Py_ssize_t pos, char c) except -1:
+    """
+    Position of the next `c' at or after `pos'.
+    """
+    while pos < length:
+        if buf[pos] == c:
+            return pos
+        pos += 1
+    raise ValueError()
+
+
+cpdef dict parse(str keyData):
+    """
+    Everything comes in 2's, so the dictionaries of dictionaries ... are
+    filled in a single pass, alternating between a key and its value at each
+    level.
+    """
+    cdef Py_ssize_t length
+    cdef const char *buf = PyUnicode_AsUTF8AndSize(keyData, &length)
+    cdef Py_ssize_t pos = 0, start, end, colon
+    cdef char tag
+
+    # Levels enclosing `currentDict', whose keys have all been assigned
+    cdef list stack = []
+    cdef dict result = None, currentDict = None, level
+    cdef object pendingKey = None, value
+
+    try:
+        while pos < length:
+            tag = buf[pos]
+            if tag == b'a':
+                # a:<count>:{ ... }
+                level = {}
+                if currentDict is not None:
+                    if pendingKey is None:
+                        raise ValueError()
+                    currentDict[pendingKey] = level
+                    stack.append(currentDict)
+                elif result is None:
+                    result = level
+                currentDict, pendingKey = level, None
+                pos = _index(buf, length, pos, b'{') + 1
+                continue
+            elif tag == b'}' and currentDict is not None:
+                currentDict = stack.pop() if stack else None
+                pendingKey = None
+                pos += 1
+                continue
+            elif currentDict is None:
+                # Values only ever appear inside an array
+                raise ValueError()
+            elif tag == b'i':
+                # i:<value>;
+                end = _index(buf, length, pos, b';')
+                if end < pos + 2:
+                    raise ValueError()
+                value = int(buf[pos + 2:end])
+                pos = end
+            elif tag == b's':
+                # s:<length>:"<value>"; -- the value may contain `"'
+                colon = _index(buf, length, pos + 2, b':')
+                start = colon + 2
+                end = start + int(buf[pos + 2:colon])
+                if end < start or end >= length or buf[end] != b'"':
+                    raise ValueError()
+                value = buf[start:end].decode('utf-8')
+                pos = end + 1
+            elif tag == b'b':
+                # b:<0|1>;
+                if pos + 2 >= length:
+                    raise ValueError()
+                value = buf[pos + 2] == b'1'
+                pos += 3
+            else:
+                raise ValueError()
+
+            if pos < length and buf[pos] == b';':
+                pos += 1
+
+            if pendingKey is None:
+                pendingKey = value
+            else:
+                currentDict[pendingKey] = value
+                pendingKey = None
+    except (ValueError, OverflowError):
+        # Show what it's stuck on so we can debug it
+        raise ValueError(buf[pos:length].decode('utf-8', 'replace')) from None
+
+    if currentDict is not None or result is None:
+        # Ran out of input before every array was closed
+        raise ValueError(keyData)
+
+    return result
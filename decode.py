@@ -5,10 +5,17 @@
 Decode JSON serialized.
 """
 
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Any
+from collections import deque
+from functools import lru_cache
 
 import os
-import re
+
+try:
+    # Optional compiled parser, built from convertjson_fast.pyx
+    from convertjson_fast import parse as _fastParse
+except ImportError:
+    _fastParse = None
 
 
 class InvalidArrayFormat(SyntaxError):
@@ -22,91 +29,123 @@ class ConvertJSON:
     Methods for working on our (*ahem* horrid) JSON.
     """
 
-    # Match these 'tokens'
-    integer = r'^i:[0-9]+;?'
-    string  = r'^s:[0-9]+:\"[^\"]*\";?'
-    array   = r'^a:[0-9]+:{'
-    boolean = r'^b:[01];?'
-    endArr  = r'^}'
-
-    lexer = re.compile('({}|{}|{}|{}|{})'.format(integer, string, array, endArr,
-                                                 boolean))
-
-    # `:' between parentheses will break unpacking if we just `.split(':')`
-    colonStringSplit = re.compile(r'(?<=s):|:(?=")')
-
     def decode(self, key: str) -> Dict:
         """
-        Decode our JSON with regex into something a little nicer. In Python 3.5,
-        if I'm not mistaken, dictionaries don't necessarily keep their order, so
-        I've decided to use lists instead to unpack all of the keyData into.
-        Then a second pass converts this list of lists ... into a dictionary of
-        dictionaries ...
+        Decode our JSON into something a little nicer. Results are cached by
+        path and modification time, so an unchanged file is only parsed once;
+        the returned dictionary is shared, so don't modify it.
         """
         if not os.path.isfile(key):
             raise FileNotFoundError('File {} does not exist'.format(key))
 
-        with open(key, 'r') as keykeyData:
-            keyData = keykeyData.readline().rstrip()
-
-        def nestLevel(currentList: Optional[List] =None) -> List:
-            """
-            Allow the traversal of all nested levels.
-            """
-            nonlocal keyData
-
-            if currentList is None:
-                currentList = []
-
-            while keyData:
-                # Can't wait till assignment expressions!
-                result = re.search(self.lexer, keyData)
-
-                if not result:
-                    # Show what it's stuck on so we can debug it
-                    raise InvalidArrayFormat(keyData)
-
-                start, end = result.span()
-                substring = keyData[:end]
-                keyData = keyData[end:]
-
-                if substring.endswith(';'):
-                    substring = substring[:-1]
-
-                # Parse. Everything comes in 2's
-                if substring.startswith('a'):
-                    currentList.append(nestLevel([]))
-                elif substring.startswith('i'):
-                    _, value = substring.split(':')
-                    currentList.append(int(value))
-                elif substring.startswith('s'):
-                    _, _, value = re.split(self.colonStringSplit, substring)
-                    value = value[1:len(value) - 1]
-                    currentList.append(value)
-                elif substring.startswith('b'):
-                    _, value = substring.split(':')
-                    currentList.append(bool(value))
-                elif substring.startswith('}'):
-                    return currentList
-            return currentList
-
-        def convert(multiLevelArray: List) -> Dict:
-            """
-            Convert our multi-level list to a dictionary of dictionaries ...
-            """
-            length = len(multiLevelArray)
-            currentDict = {}
-
-            for i, j in zip(range(0, length - 1, 2), range(1, length, 2)):
-                key, val = multiLevelArray[i], multiLevelArray[j]
-                if type(val) is list:
-                    currentDict[key] = convert(val)
+        return self._decode(key, os.stat(key).st_mtime_ns)
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _decode(key: str, mtime: int) -> Dict:
+        """
+        Read and parse a key. `mtime' is only here to key the cache.
+        """
+        # Keys are a single line; read the lot in one go
+        with open(key, 'r', buffering=65536) as keykeyData:
+            keyData = keykeyData.read().rstrip()
+
+        if _fastParse is not None:
+            try:
+                return _fastParse(keyData)
+            except ValueError as err:
+                raise InvalidArrayFormat(*err.args) from None
+
+        return ConvertJSON.parse(keyData)
+
+    @staticmethod
+    def parse(keyData: str) -> Dict:
+        """
+        Everything comes in 2's, so the dictionaries of dictionaries ... are
+        filled in a single pass, alternating between a key and its value at
+        each level. `convertjson_fast.parse' is the compiled equivalent.
+
+        PHP counts string lengths in bytes, so this works over the key's UTF-8
+        encoding:
+
+        >>> ConvertJSON.parse('a:1:{s:2:"é";i:1;}')
+        {'é': 1}
+        """
+        data = keyData.encode('utf-8')
+        length = len(data)
+        index = data.index
+
+        # Levels enclosing `currentDict`, whose keys have all been assigned
+        stack = []
+        result = currentDict = pendingKey = None
+        pos = 0
+
+        try:
+            while pos < length:
+                tag = data[pos:pos + 1]
+                if tag == b'a':
+                    # a:<count>:{ ... }
+                    level = {}
+                    if currentDict is not None:
+                        if pendingKey is None:
+                            raise ValueError()
+                        currentDict[pendingKey] = level
+                        stack.append(currentDict)
+                    elif result is None:
+                        result = level
+                    currentDict, pendingKey = level, None
+                    pos = index(b'{', pos) + 1
+                    continue
+                elif tag == b'}' and currentDict is not None:
+                    currentDict = stack.pop() if stack else None
+                    pendingKey = None
+                    pos += 1
+                    continue
+                elif currentDict is None:
+                    # Values only ever appear inside an array
+                    raise ValueError()
+                elif tag == b'i':
+                    # i:<value>;
+                    end = index(b';', pos)
+                    value = int(data[pos + 2:end])
+                    pos = end
+                elif tag == b's':
+                    # s:<length>:"<value>"; -- the value may contain `"'
+                    colon = index(b':', pos + 2)
+                    start = colon + 2
+                    end = start + int(data[pos + 2:colon])
+                    if end < start or data[end:end + 1] != b'"':
+                        raise ValueError()
+                    value = data[start:end].decode('utf-8')
+                    pos = end + 1
+                elif tag == b'b':
+                    # b:<0|1>;
+                    if pos + 2 >= length:
+                        raise ValueError()
+                    value = data[pos + 2:pos + 3] == b'1'
+                    pos += 3
                 else:
-                    currentDict[key] = val
+                    raise ValueError()
+
+                if data[pos:pos + 1] == b';':
+                    pos += 1
 
-            return currentDict
+                if pendingKey is None:
+                    pendingKey = value
+                else:
+                    currentDict[pendingKey] = value
+                    pendingKey = None
+        except ValueError:
+            # Show what it's stuck on so we can debug it
+            raise InvalidArrayFormat(
+                data[pos:].decode('utf-8', 'replace')
+            ) from None
 
-        return convert(nestLevel()[0])
+        if currentDict is not None or result is None:
+            # Ran out of input before every array was closed
+            raise InvalidArrayFormat(keyData)
+
+        return result
 
     @staticmethod
     def find(nestedDicts: Dict, key: Any) -> Any:
@@ -116,18 +155,18 @@ class ConvertJSON:
 
         (Iterable b => b -> a) so we can map over partial applications.
         """
+        # Depth-first, in order; each level is an iterator over its items
+        levels = deque([iter(nestedDicts.items())])
 
-        def traverse(nested: Dict) -> Any:
-            nonlocal key
-            for ky, value in list(nested.items()):
+        while levels:
+            for ky, value in levels[-1]:
                 if ky == key:
                     return value
-                if type(value) is dict:
-                    res = traverse(value)
-                    if res:
-                        return res
-
-        return traverse(nestedDicts)
+                if isinstance(value, dict):
+                    levels.append(iter(value.items()))
+                    break
+            else:
+                levels.pop()
 
     @staticmethod
     def findAll(nestedDicts: Dict, key: Any, byValue: bool = False) -> List:
@@ -137,18 +176,20 @@ class ConvertJSON:
         (Essentially a reverse lookup.)
         """
         occurrences = []
+        levels = deque([iter(nestedDicts.items())])
 
-        def traverse(nested: Dict) -> None:
-            nonlocal key, occurrences
-            for ky, value in list(nested.items()):
+        while levels:
+            for ky, value in levels[-1]:
                 if byValue:
                     if value == key:
                         occurrences.append(ky)
                 else:
                     if ky == key:
                         occurrences.append(value)
-                if type(value) is dict:
-                    traverse(value)
+                if isinstance(value, dict):
+                    levels.append(iter(value.items()))
+                    break
+            else:
+                levels.pop()
 
-        traverse(nestedDicts)
         return occurrences
@@ -25,9 +25,14 @@ elif minor < 5:
     raise Exception('Must use Python 3.5+, you\'re using Python 3.{}'\
             .format(minor))
 
-from typing import List, Dict, Optional, Any
-from subprocess import Popen
-from functools import partial
+# Nothing here needs CPython; with big key files, `pypy3 time.py ...' is faster.
+
+from typing import List, Dict, Any
+from subprocess import run, PIPE
+from concurrent.futures import Executor, ThreadPoolExecutor
+from collections import deque
+from functools import partial, lru_cache
+from itertools import chain
 from os.path import basename
 from glob import glob
 
@@ -35,22 +40,28 @@ import warnings
 import json
 import argparse
 import os
-import datetime
+import shlex
 import re
 
-# Regexes
-spaces   = re.compile(r'[\s\t]+')
-newlines = re.compile(r'\n+')
-epoch    = re.compile(r'(?<=@)[0-9]+')
-schedule = re.compile(r'\"0\";i:[0-9]{1,3};') # pluck out hours of backups
-transfer = re.compile(r'[0-9]+(?=:)')
-pauses   = re.compile(r'pause')
+try:
+    # Optional compiled parser, built from convertjson_fast.pyx
+    from convertjson_fast import parse as _fastParse
+except ImportError:
+    _fastParse = None
+
+# Regexes (everything they're run over is ASCII)
+schedule = re.compile(r'\"0\";i:[0-9]{1,3};', re.ASCII) # hours of backups
+transfer = re.compile(r'[0-9]+(?=:)', re.ASCII)
+pauses   = re.compile(r'pause', re.ASCII)
 
 # Shell
-ZFS_agent_list = 'zfs list -H -o name | awk \'/(agents\/)/\''
+ZFS_agent_list = 'zfs list -H -o name'  # only those under `AGENTS`
 ZFS_list_snapshots = 'zfs list -t snapshot -Hrp -o name,written,compressratio'
 SS_Options = 'speedsync options'
 
+# Agent datasets
+AGENTS = 'agents/'
+
 # Key path and extensions
 KEYS = '/datto/config/keys/'
 SPEEDSYNC_OPTIONS_AGENT = '/datto/config/sync/*+{}+agent/options' # glob
@@ -67,10 +78,16 @@ OFFSITE_SCHEDULE  = '.offsiteSchedule'  # `schedule`
 OFFSITE_POINTS    = '.offSitePoints'    # Just numbers
 TRANSFERS_DONE    = '.transfers'        # `transfer`
 
+# The key files that are actually read, per agent
+KEY_EXTENSIONS = (LOCAL_RETENTION, LOCAL_SCHEDULE, BACKUP_INTERVAL,
+                  OFFSITE_RETENTION)
+
 # Other configs
 SPEED_LIMIT = '/datto/config/local/speedLimit' # Upload speed limit
 
-NOW = datetime.datetime.now()
+# Threads for per-agent I/O (subprocesses and key files)
+MAX_WORKERS = 32
+
 _WARN = partial(warnings.warn, stacklevel=2, category=RuntimeWarning)
 
 
@@ -79,91 +96,123 @@ class ConvertJSON:
     Methods for working on our (*ahem* horrid) JSON.
     """
 
-    # Match these 'tokens'
-    integer = r'^i:[0-9]+;?'
-    string  = r'^s:[0-9]+:\"[^\"]*\";?'
-    array   = r'^a:[0-9]+:{'
-    boolean = r'^b:[01];?'
-    endArr  = r'^}'
-
-    lexer = re.compile('({}|{}|{}|{}|{})'.format(integer, string, array, endArr,
-                                                 boolean))
-
-    # `:' between parentheses will break unpacking if we just `.split(':')`
-    colonStringSplit = re.compile(r'(?<=s):|:(?=")')
-
     def decode(self, key: str) -> Dict:
         """
-        Decode our JSON with regex into something a little nicer. In Python 3.5,
-        if I'm not mistaken, dictionaries don't necessarily keep their order, so
-        I've decided to use lists instead to unpack all of the keyData into.
-        Then a second pass converts this list of lists ... into a dictionary of
-        dictionaries ...
+        Decode our JSON into something a little nicer. Results are cached by
+        path and modification time, so an unchanged file is only parsed once;
+        the returned dictionary is shared, so don't modify it.
         """
         if not os.path.isfile(key):
             raise FileNotFoundError('File {} does not exist'.format(key))
 
-        with open(key, 'r') as keyData:
-            keyData = keyData.readline().rstrip()
-
-        def nestLevel(currentList: Optional[List] =None) -> List:
-            """
-            Allow the traversal of all nested levels.
-            """
-            nonlocal keyData
-
-            if currentList is None:
-                currentList = []
-
-            while keyData:
-                # Can't wait till assignment expressions!
-                result = re.search(self.lexer, keyData)
-
-                if not result:
-                    # Show what it's stuck on so we can debug it
-                    raise InvalidArrayFormat(keyData)
-
-                start, end = result.span()
-                substring = keyData[:end]
-                keyData = keyData[end:]
-
-                if substring.endswith(';'):
-                    substring = substring[:-1]
-
-                # Parse. Everything comes in 2's
-                if substring.startswith('a'):
-                    currentList.append(nestLevel([]))
-                elif substring.startswith('i'):
-                    _, value = substring.split(':')
-                    currentList.append(int(value))
-                elif substring.startswith('s'):
-                    _, _, value = re.split(self.colonStringSplit, substring)
-                    value = value[1:len(value) - 1]
-                    currentList.append(value)
-                elif substring.startswith('b'):
-                    _, value = substring.split(':')
-                    currentList.append(bool(value))
-                elif substring.startswith('}'):
-                    return currentList
-            return currentList
-
-        def convert(multiLevelArray: List) -> Dict:
-            """
-            Convert our multi-level list to a dictionary of dictionaries ...
-            """
-            length = len(multiLevelArray)
-            currentDict = {}
-
-            for i, j in zip(range(0, length - 1, 2), range(1, length, 2)):
-                key, val = multiLevelArray[i], multiLevelArray[j]
-                if type(val) is list:
-                    currentDict[key] = convert(val)
+        return self._decode(key, os.stat(key).st_mtime_ns)
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _decode(key: str, mtime: int) -> Dict:
+        """
+        Read and parse a key. `mtime' is only here to key the cache.
+        """
+        # Keys are a single line; read the lot in one go
+        with open(key, 'r', buffering=65536) as keykeyData:
+            keyData = keykeyData.read().rstrip()
+
+        if _fastParse is not None:
+            try:
+                return _fastParse(keyData)
+            except ValueError as err:
+                raise InvalidArrayFormat(*err.args) from None
+
+        return ConvertJSON.parse(keyData)
+
+    @staticmethod
+    def parse(keyData: str) -> Dict:
+        """
+        Everything comes in 2's, so the dictionaries of dictionaries ... are
+        filled in a single pass, alternating between a key and its value at
+        each level. `convertjson_fast.parse' is the compiled equivalent.
+
+        PHP counts string lengths in bytes, so this works over the key's UTF-8
+        encoding:
+
+        >>> ConvertJSON.parse('a:1:{s:2:"é";i:1;}')
+        {'é': 1}
+        """
+        data = keyData.encode('utf-8')
+        length = len(data)
+        index = data.index
+
+        # Levels enclosing `currentDict`, whose keys have all been assigned
+        stack = []
+        result = currentDict = pendingKey = None
+        pos = 0
+
+        try:
+            while pos < length:
+                tag = data[pos:pos + 1]
+                if tag == b'a':
+                    # a:<count>:{ ... }
+                    level = {}
+                    if currentDict is not None:
+                        if pendingKey is None:
+                            raise ValueError()
+                        currentDict[pendingKey] = level
+                        stack.append(currentDict)
+                    elif result is None:
+                        result = level
+                    currentDict, pendingKey = level, None
+                    pos = index(b'{', pos) + 1
+                    continue
+                elif tag == b'}' and currentDict is not None:
+                    currentDict = stack.pop() if stack else None
+                    pendingKey = None
+                    pos += 1
+                    continue
+                elif currentDict is None:
+                    # Values only ever appear inside an array
+                    raise ValueError()
+                elif tag == b'i':
+                    # i:<value>;
+                    end = index(b';', pos)
+                    value = int(data[pos + 2:end])
+                    pos = end
+                elif tag == b's':
+                    # s:<length>:"<value>"; -- the value may contain `"'
+                    colon = index(b':', pos + 2)
+                    start = colon + 2
+                    end = start + int(data[pos + 2:colon])
+                    if end < start or data[end:end + 1] != b'"':
+                        raise ValueError()
+                    value = data[start:end].decode('utf-8')
+                    pos = end + 1
+                elif tag == b'b':
+                    # b:<0|1>;
+                    if pos + 2 >= length:
+                        raise ValueError()
+                    value = data[pos + 2:pos + 3] == b'1'
+                    pos += 3
+                else:
+                    raise ValueError()
+
+                if data[pos:pos + 1] == b';':
+                    pos += 1
+
+                if pendingKey is None:
+                    pendingKey = value
                 else:
-                    currentDict[key] = val
+                    currentDict[pendingKey] = value
+                    pendingKey = None
+        except ValueError:
+            # Show what it's stuck on so we can debug it
+            raise InvalidArrayFormat(
+                data[pos:].decode('utf-8', 'replace')
+            ) from None
 
-            return currentDict
+        if currentDict is not None or result is None:
+            # Ran out of input before every array was closed
+            raise InvalidArrayFormat(keyData)
 
-        return convert(nestLevel()[0])
+        return result
 
     @staticmethod
     def find(nestedDicts: Dict, key: Any) -> Any:
@@ -173,18 +222,18 @@ class ConvertJSON:
 
         (Iterable b => b -> a) so we can map over partial applications.
         """
+        # Depth-first, in order; each level is an iterator over its items
+        levels = deque([iter(nestedDicts.items())])
 
-        def traverse(nested: Dict) -> Any:
-            nonlocal key
-            for ky, value in list(nested.items()):
+        while levels:
+            for ky, value in levels[-1]:
                 if ky == key:
                     return value
-                if type(value) is dict:
-                    res = traverse(value)
-                    if res:
-                        return res
-
-        return traverse(nestedDicts)
+                if isinstance(value, dict):
+                    levels.append(iter(value.items()))
+                    break
+            else:
+                levels.pop()
 
     @staticmethod
     def findAll(nestedDicts: Dict, key: Any, byValue: bool =False) -> List:
@@ -194,20 +243,22 @@ class ConvertJSON:
         (Essentially a reverse lookup.)
         """
         occurrences = []
+        levels = deque([iter(nestedDicts.items())])
 
-        def traverse(nested: Dict) -> None:
-            nonlocal key, occurrences
-            for ky, value in list(nested.items()):
+        while levels:
+            for ky, value in levels[-1]:
                 if byValue:
                     if value == key:
                         occurrences.append(ky)
                 else:
                     if ky == key:
                         occurrences.append(value)
-                if type(value) is dict:
-                    traverse(value)
+                if isinstance(value, dict):
+                    levels.append(iter(value.items()))
+                    break
+            else:
+                levels.pop()
 
-        traverse(nestedDicts)
         return occurrences
 
 
@@ -219,15 +270,19 @@ class Timeline:
 
     def __init__(self, arguments: argparse.Namespace) -> None:
         # Get a master list of ZFS datasets/agents.
-        self.masterAgents = getIO(ZFS_agent_list)
+        self.masterAgents = [dataset for dataset in getIO(ZFS_agent_list)
+                             if AGENTS in dataset]
 
         # Check the requested agents against master list of agents
         if arguments.agents:
-            arguments.agents = flatten(arguments.agents)
-            for uuid in arguments.agents:
-                if uuid not in self.masterAgents:
+            datasets = set(self.masterAgents)
+            requested = []
+            for uuid in flatten(arguments.agents):
+                if uuid in datasets:
+                    requested.append(uuid)
+                else:
                     _WARN(uuid + ' is not in the dataset, excluding')
-                    arguments.agents.remove(uuid)
+            arguments.agents = requested
             if not arguments.agents:
                 _WARN('Defaulting to complete dataset')
                 arguments.agents = self.masterAgents
@@ -235,24 +290,37 @@ class Timeline:
             arguments.agents = self.masterAgents
 
         self.agents = arguments.agents
-        self.agent_identifiers = list(map(basename, arguments.agents))
 
-        # Grab data about snapshots and retention policies.
-        self.snaps = list(map(self.getSnapshots, self.agents))
+        # Grab data about snapshots, for every agent in one `zfs list`.
+        snapshots = self.getSnapshots(self.agents)
+
+        # Then, in one pass over the agents, their identifiers, the paths to
+        # their key files (built once) and their snapshots.
+        self.agent_identifiers = []
+        self.keys = {}
+        self.snaps = []
+        for agent in self.agents:
+            identifier = basename(agent)
+            self.agent_identifiers.append(identifier)
+            self.keys[identifier] = keyPaths(identifier)
+            self.snaps.append(snapshots[agent])
         self._checkSnaps()
 
-        # Grab retention policies.
-        self.local_ret_policies = list(map(
-            self.decodeRetention,
-            self.agent_identifiers
-        ))
-        self.offsite_ret_policies = list(map(
-            partial(self.decodeRetention, offsite=True),
-            self.agent_identifiers
-        ))
-
-        # Decode schedules and store them in a list.
-        self.schedules = self._acquireSchedules()
+        # Everything below is blocking I/O per agent, so fan it out.
+        with ThreadPoolExecutor(max_workers=_workers(self.agents)) as pool:
+            # Grab retention policies. There's offsite and local retention
+            # policies on our appliances.
+            self.local_ret_policies = list(pool.map(
+                self.decodeRetention,
+                self._keyFiles(LOCAL_RETENTION)
+            ))
+            self.offsite_ret_policies = list(pool.map(
+                self.decodeRetention,
+                self._keyFiles(OFFSITE_RETENTION)
+            ))
+
+            # Decode schedules and store them in a list.
+            self.schedules = self._acquireSchedules(pool)
 
         # Map these schedules to a function that'll find all the hours we're
         # taking backups. This is the same as
@@ -289,16 +357,20 @@ class Timeline:
                 _WARN(agent + ' has no snapshots, excluding')
                 self.agent_identifiers.remove(agent)
 
-    def _acquireSchedules(self) -> List[Dict[int, int]]:
+    def _keyFiles(self, extension: str) -> List[str]:
+        """
+        Paths to one of the key files (by `extension`) of every agent.
+        """
+        return [self.keys[agent][extension] for agent in self.agent_identifiers]
+
+    def _acquireSchedules(self, pool: Executor) -> List[Dict[int, int]]:
         """
         Get a list of schedules, which are dictionaries of Hour -> True/False.
         """
-        schedules = []
-        for agent in self.agent_identifiers:
-            self.schedules.append(
-                self.JSONdecoder.decode(KEYS + agent + LOCAL_SCHEDULE)
-            )
-        return schedules
+        return list(pool.map(
+            self.JSONdecoder.decode,
+            self._keyFiles(LOCAL_SCHEDULE)
+        ))
 
     def _acquireIntervals(self) -> List[int]:
         """
@@ -306,8 +378,7 @@ class Timeline:
         backups are acquired.
         """
         intervals = []
-        for agent in self.agent_identifiers:
-            intervalPath = KEYS + agent + BACKUP_INTERVAL
+        for intervalPath in self._keyFiles(BACKUP_INTERVAL):
             with open(intervalPath, 'r') as intervalFile:
                 intervals.append(int(intervalFile.readline().rstrip()))
         return intervals
@@ -354,73 +425,84 @@ class Timeline:
         """
 
     @staticmethod
-    def decodeRetention(agent: str, offsite: bool = False) -> List[int]:
+    def decodeRetention(path: str) -> List[int]:
         """
-        Read the retention policy for an agent from file.
+        Read an agent's (local or offsite) retention policy from its key file.
         """
-        # There's offsite and local retention policies on our appliances.
-        with open(KEYS + agent + (OFFSITE_RETENTION if offsite
-        else LOCAL_RETENTION)) as cryptic_policy:
-            policy = cryptic_policy.readline().split(':')
+        with open(path) as cryptic_policy:
+            policy = cryptic_policy.read().rstrip()
 
         # Now let's decode what's _really_ going to happen to this data.
         # everything is dependent upon the last number in the 4-tuple.
-        intra, daily, weekly, total = policy
+        intra, daily, weekly, total = policy.split(':')
 
         # intra: 1d - 31d
         # daily: 1w - 26w
         # weekly: 1m - 24m, or up to ~27 years (maxes out at 240000hrs)
         # total: 1w - 7y, or up to ~27 years, again
 
-        return [intra, daily, weekly, total]
+        return [int(intra), int(daily), int(weekly), int(total)]
 
     @staticmethod
-    def getSnapshots(agent: str) -> Dict[int, str]:
+    def getSnapshots(agents: List[str]) -> Dict[str, Dict[int, int]]:
         """
-        Get a list of snapshots from a particular agent.
+        Get the snapshots of every agent in `agents` with a single `zfs list`,
+        as a dictionary of agent -> (epoch -> transfer size).
         """
-        snapshots = getIO(ZFS_list_snapshots + ' ' + agent)[:-1]
+        snapshots = {agent: {} for agent in agents}
 
-        for i, snapshot in enumerate(snapshots):
-            snapshots[i] = re.split(spaces, snapshot)
+        for snapshot in getIO(ZFS_list_snapshots + ' ' + ' '.join(agents)):
+            # name, written, compressratio (e.g. `pool/agents/uuid@1529000000`)
+            name, written, ratio = snapshot.split()
+            dataset, _, epoch = name.partition('@')
 
             # Pull out relevant data for readability
-            epochInt = int(re.search(epoch, snapshot).group())
-            compressRatio = float(snapshots[i][2][:-1])
-            epochSize = int(snapshots[i][1])
+            epochInt = int(epoch)
+            compressRatio = float(ratio[:-1])
+            epochSize = int(written)
 
-            # Reorganize this list as [epoch, transfer size]
-            snapshots[i] = [epochInt, int(epochSize * compressRatio)]
+            # `-r' also lists snapshots of any child datasets; skip those
+            if dataset in snapshots:
+                snapshots[dataset][epochInt] = int(epochSize * compressRatio)
 
-        return dict(snapshots)
+        return snapshots
 
 
 def getIO(command: str) -> List[str]:
     """
-    Get results from terminal commands as lists of lines of text.
+    Get results from terminal commands as lists of lines of text. Commands are
+    run directly, not through a shell.
     """
-    with Popen(command, shell=True) as proc:
-        stdout, stderr = proc.communicate()
+    # `capture_output=True' and `text=True' are 3.7+, so spell them out
+    proc = run(shlex.split(command), stdout=PIPE, stderr=PIPE,
+               universal_newlines=True)
+
+    if proc.returncode or proc.stderr:
+        raise ValueError('Command exited with errors: {}'.format(proc.stderr))
+
+    return proc.stdout.splitlines()
 
-    if stderr:
-        raise ValueError('Command exited with errors: {}'.format(stderr))
 
-    # Further processing
-    if stdout:
-        stdout = re.split(newlines, stdout.decode())
+def keyPaths(agent: str) -> Dict[str, str]:
+    """
+    Map each key file extension to that file's path for `agent`.
+    """
+    return {extension: KEYS + agent + extension
+            for extension in KEY_EXTENSIONS}
+
 
-    return stdout
+def _workers(agents: List[str]) -> int:
+    """
+    Number of threads to run per-agent I/O with; one per agent, up to a cap.
+    """
+    return max(1, min(MAX_WORKERS, len(agents)))
 
 
 def flatten(inList: List[List]) -> List:
     """
     Similar to Haskell's `concat :: [[a]] -> [a]`.
     """
-    flatList = []
-    for subList in inList:
-        for string in subList:
-            flatList.append(string)
-    return flatList
+    return list(chain.from_iterable(inList))
 
 
 class InvalidArrayFormat(SyntaxError):